@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+
+# The shared map helpers live in the Map_Generators folder
+MAP_GENERATORS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Map_Generators')
+sys.path.append(MAP_GENERATORS)
+import Map_Utils as map_utils
+import Geometry_Utils as geometry_utils
+Utils = map_utils.Utils()
+
+MAPS = {
+    'verywide': map_utils.VeryWide,
+    'regional': map_utils.Regional,
+    'local': map_utils.Local,
+    'tropical': map_utils.Tropical,
+    'country': map_utils.Country,
+}
+
+
+def main():
+    # Draw the Natural Earth features from the local store
+    geometry_utils.FeatureStore.use_local_data()
+
+    parser = argparse.ArgumentParser(description='Render the static layers of every map type for the map generators.')
+    parser.add_argument('-m', '--map', nargs='+', choices=list(MAPS), default=list(MAPS),
+                        help='Which map types to build.')
+    parser.add_argument('-s', '--layer-set', nargs='+', choices=list(geometry_utils.Basemap.layer_sets),
+                        default=list(geometry_utils.Basemap.layer_sets),
+                        help='Which generators\' layer sets to build.')
+    parser.add_argument('-f', '--force', action='store_true', help='Render the basemaps even when they are current.')
+    args = parser.parse_args()
+
+    for layer_set in args.layer_set:
+        for map_type in args.map:
+            if geometry_utils.Basemap.build(layer_set, MAPS[map_type](), force=args.force):
+                print('Built the {} {} basemap'.format(layer_set, map_type))
+            else:
+                print('The {} {} basemap is up to date'.format(layer_set, map_type))
+
+
+if __name__ == '__main__':
+    # Use the same output and cache folders as the generators
+    os.chdir(MAP_GENERATORS)
+    Utils.create_output_directory()
+    main()
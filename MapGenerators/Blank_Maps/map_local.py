@@ -1,3 +1,6 @@
+import os
+import sys
+
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import cartopy.io.shapereader as shpreader
@@ -9,6 +12,10 @@ from matplotlib.offsetbox import AnchoredText, OffsetImage,  AnnotationBbox
 import numpy as np
 from PIL import Image
 
+# The shared map helpers live in the Map_Generators folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Map_Generators'))
+import Geometry_Utils as geometry_utils
+
 class City:
     def __init__(self, city_name, lat, lon):
         self.city_name = city_name
@@ -17,6 +24,9 @@ class City:
 
 
 def main():
+    # Draw the Natural Earth features from the local store
+    geometry_utils.FeatureStore.use_local_data()
+
     reader = shpreader.Reader('./county_data/countyl010g.shp')
     counties = list(reader.geometries())
     COUNTIES = cfeature.ShapelyFeature(counties, ccrs.PlateCarree())
@@ -78,18 +88,14 @@ def main():
     ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
     ax.set_extent([-91.5, -86.5, 29.5, 33.5], crs=ccrs.Geodetic())
 
-    # Create a feature for States/Admin 1 regions at 1:50m from Natural Earth
-    states_provinces = cfeature.NaturalEarthFeature(
-        category='cultural',
-        name='admin_1_states_provinces_lines',
-        scale='50m',
-        facecolor='none')
+    # Natural Earth features come from the local store, at the scale of this map type
+    states_provinces = geometry_utils.FeatureStore.feature('state_lines', 'local')
 
     # Features for the figure
-    ax.add_feature(cfeature.LAND)
+    ax.add_feature(geometry_utils.FeatureStore.feature('land', 'local'))
     ax.add_feature(COUNTIES, facecolor='none', edgecolor='lightgray')
     ax.add_feature(states_provinces, edgecolor='gray')
-    ax.add_feature(cfeature.COASTLINE, edgecolor='lightgray')
+    ax.add_feature(geometry_utils.FeatureStore.feature('coastline', 'local'), edgecolor='lightgray')
 
     # Plot all the cities
     for city in cities:
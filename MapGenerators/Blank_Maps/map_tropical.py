@@ -1,14 +1,20 @@
+import os
+import sys
+
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 import matplotlib.image as mat_img
 import matplotlib.figure
-import cartopy.feature as cfeature
 from matplotlib.offsetbox import AnchoredText, OffsetImage,  AnnotationBbox
 import matplotlib.image as mpimg
 from PIL import Image
 import numpy as np
 import pygrib
 
+# The shared map helpers live in the Map_Generators folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Map_Generators'))
+import Geometry_Utils as geometry_utils
+
 class Country:
     def __init__(self, country_name, lat, lon):
         self.country_name = country_name
@@ -18,22 +24,21 @@ class Country:
 
 def main():
 
+    # Draw the Natural Earth features from the local store
+    geometry_utils.FeatureStore.use_local_data()
+
     # Create the figure and set the frame
     fig = plt.figure()
     ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
     ax.set_extent([-97.5, -15.5, 8.5, 30.5], crs=ccrs.Geodetic())
 
-    # Create a feature for States/Admin 1 regions at 1:50m from Natural Earth
-    countries = cfeature.NaturalEarthFeature(
-        category='cultural',
-        name='admin_0_countries',
-        scale='50m',
-        facecolor='none')
+    # Natural Earth features come from the local store, at the scale of this map type
+    countries = geometry_utils.FeatureStore.feature('countries', 'tropical')
 
     # Features for the figure
-    ax.add_feature(cfeature.LAND)
+    ax.add_feature(geometry_utils.FeatureStore.feature('land', 'tropical'))
     ax.add_feature(countries, edgecolor='lightgray')
-    ax.add_feature(cfeature.COASTLINE, edgecolor='lightgray')
+    ax.add_feature(geometry_utils.FeatureStore.feature('coastline', 'tropical'), edgecolor='lightgray')
 
     # Plot all the cities
     # for city in cities:
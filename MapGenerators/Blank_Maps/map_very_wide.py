@@ -1,14 +1,20 @@
+import os
+import sys
+
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 import matplotlib.image as mat_img
 import matplotlib.figure
-import cartopy.feature as cfeature
 from matplotlib.offsetbox import AnchoredText, OffsetImage,  AnnotationBbox
 import matplotlib.image as mpimg
 from PIL import Image
 import numpy as np
 import pygrib
 
+# The shared map helpers live in the Map_Generators folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Map_Generators'))
+import Geometry_Utils as geometry_utils
+
 class City:
     def __init__(self, city_name, lat, lon):
         self.city_name = city_name
@@ -18,6 +24,9 @@ class City:
 
 def main():
 
+    # Draw the Natural Earth features from the local store
+    geometry_utils.FeatureStore.use_local_data()
+
     ### List out all the cities you want plotted
     #  - MISSISSIPPI
     hattiesburg = City('Hattiesburg', 31.3271, -89.2903)
@@ -99,16 +108,12 @@ def main():
     # grbs = pygrib.open(grib)
     # print(grbs)
 
-    # Create a feature for States/Admin 1 regions at 1:50m from Natural Earth
-    states_provinces = cfeature.NaturalEarthFeature(
-        category='cultural',
-        name='admin_1_states_provinces_lines',
-        scale='50m',
-        facecolor='none')
+    # Natural Earth features come from the local store, at the scale of this map type
+    states_provinces = geometry_utils.FeatureStore.feature('state_lines', 'verywide')
 
     # Features for the figure
-    ax.add_feature(cfeature.LAND)
-    ax.add_feature(cfeature.COASTLINE, edgecolor='lightgray')
+    ax.add_feature(geometry_utils.FeatureStore.feature('land', 'verywide'))
+    ax.add_feature(geometry_utils.FeatureStore.feature('coastline', 'verywide'), edgecolor='lightgray')
     ax.add_feature(states_provinces, edgecolor='gray')
 
     # Plot all the cities
@@ -1,28 +1,29 @@
-import os
 import argparse
 
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import cartopy.io.shapereader as shpreader
 import matplotlib.pyplot as plt
 from matplotlib.offsetbox import AnchoredText
-import pygrib
 
 import Map_Utils as map_utils
+import Geometry_Utils as geometry_utils
+import Dataset_Utils as dataset_utils
+import Grib_Utils as grib_utils
 Utils = map_utils.Utils()
 
 
 def download_dataset():
-    os.system('cd .. && cd SPC_CPC_dataset_downloader && cd SPC_CPC_dataset_downloader && cd spiders && scrapy '
-              'crawl SPC_CPC_dataset_downloader')
-    return
+    # Resolve and download the dataset in-process while the map is being set up
+    return dataset_utils.acquire_datasets_in_background(['CPC'])
 
 
 def main():
-    download_dataset()
+    # Draw the Natural Earth features from the local store
+    geometry_utils.FeatureStore.use_local_data()
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-m', '--map', help='Which type of map to be generated.')
+    parser.add_argument('-p', '--product', choices=['6-10day', '8-14day', '3-4week', 'monthly', 'seasonal'],
+                        help='Only draw this CPC outlook product.')
     args = parser.parse_args()
 
     if args.map == 'verywide':
@@ -36,16 +37,31 @@ def main():
     elif args.map == 'country':
         map_ = map_utils.Country()
 
+    download = download_dataset()
+
+    # Load the logo while the dataset downloads
+    logo = Utils.get_logo()
+
+    # Wait for the download before opening the dataset
+    result = download.result()['CPC']
+    if result.status == 'failed':
+        print('CPC dataset download failed: {}'.format(result.error))
+        if not result.available:
+            return
+    elif not result.changed:
+        print('CPC dataset unchanged since the last run, reusing the local copy.')
+
     # Open dataset and capture relevant info
-    file = '../output/CPC_data.grb2'
-    dataset = pygrib.open(file)
+    file = result.path
+    index = grib_utils.GribIndex.load(file)
+
+    # Fields are decoded once per dataset, later map types map the stored arrays
+    store = grib_utils.FieldStore(index)
 
-    # Grab the temperature and precipitation data from the dataset
-    precipitation_data = []
-    temperature_data = dataset.select(name='Temperature')
-    for d in dataset:
-        if str(d) not in str(temperature_data):
-            precipitation_data.append(d)
+    # Split the temperature and precipitation data of the requested product using the GRIB keys
+    cpc_messages = grib_utils.classify_cpc(index, product=args.product)
+    temperature_data = [message for message in cpc_messages if message.kind == 'Temperatures']
+    precipitation_data = [message for message in cpc_messages if message.kind == 'Precipitations']
 
     temperature_precipitation_data = {
         'Temperatures': temperature_data,
@@ -53,34 +69,26 @@ def main():
     }.items()
 
     for key, values in temperature_precipitation_data:
+        # The product may have no outlook of this kind, there is nothing to draw then
+        if not values:
+            print('No CPC {} outlook in the dataset.'.format(key.lower()))
+            continue
+
         fig = plt.figure(figsize=(15, 9))
         ax = fig.add_subplot(1, 1, 1, projection=ccrs.Mercator())
         ax.set_extent(map_.NorthSouthEastWest[::-1], crs=ccrs.Geodetic())
+
+        # States, counties, land and ocean come from the pre-rendered basemap of this map type
+        geometry_utils.Basemap.add_to(ax, map_, 'outlook')
         for value in values:
-            lats, lons = value.latlons()
-            vals = value.values
-            # Add boundaries to plot
-            ax.add_feature(cfeature.OCEAN, facecolor=cfeature.COLORS['water'])
-            if map_.map_type == 'verywide':
-                ax.add_feature(cfeature.STATES.with_scale('50m'), linewidth=0.5)
-            elif map_.map_type == 'regional' or map_.map_type == 'local':
-                ax.add_feature(cfeature.STATES.with_scale('50m'), linewidth=0.5)
-                reader = shpreader.Reader('../county_data/countyl010g.shp')
-                counties = list(reader.geometries())
-                COUNTIES = cfeature.ShapelyFeature(counties, ccrs.PlateCarree())
-                ax.add_feature(COUNTIES, facecolor='none', edgecolor='black', linewidth=0.3)
-            elif map_.map_type == 'tropical' or map_.map_type == 'country':
-                countries = cfeature.NaturalEarthFeature(
-                    category='cultural',
-                    name='admin_0_countries',
-                    scale='50m',
-                    facecolor='none')
-                ax.add_feature(cfeature.LAND)
-                ax.add_feature(countries, edgecolor='black', linewidth=0.5)
-                ax.add_feature(cfeature.STATES.with_scale('50m'), linewidth=0.5)
+            lats, lons = index.latlons(value.entry)
+            vals = store.values(value.entry)
+
+            # Only contour the part of the grid the map shows
+            lats, lons, vals = grib_utils.GridCache.crop(value.entry['grid'], map_.NorthSouthEastWest, lats, lons, vals)
 
             # Contour temperature value at each lat/lon depending on the key
-            if 'event below' in str(value):
+            if value.event == 'below':
                 if key == 'Temperatures':
                     # Contour temperature at each lat/long
                     cf = ax.contourf(lons, lats, vals,
@@ -96,7 +104,7 @@ def main():
                                      cmap='Blues')
                     cb1 = plt.colorbar(cf, ax=ax, orientation='horizontal', fraction=0.035, pad=0.08)
                 cb1.ax.set_xlabel('Probability of Below (%)')
-            elif 'event above' in str(value):
+            elif value.event == 'above':
                 if key == 'Temperatures':
                     # Contour temperature at each lat/long
                     cf = ax.contourf(lons, lats, vals,
@@ -138,7 +146,6 @@ def main():
             ax.add_artist(data_model)
 
             # Add logo
-            logo = Utils.get_logo()
             if map_.map_type == 'verywide':
                 if key == 'Temperatures':
                     ax.figure.figimage(logo, 1040, 272, zorder=1)
@@ -165,7 +172,9 @@ def main():
                 elif key == 'Precipitations':
                     ax.figure.figimage(logo, 1075, 266, zorder=1)
 
-        plt.savefig('CPC_{}_{}_Map.png'.format(key, value.validDate))
+        # Every message of this kind is drawn on the same figure, the last one drawn names the file
+        fig.savefig('CPC_{}_{}_Map.png'.format(key, values[-1].validDate))
+        plt.close(fig)
 
 
 if __name__ == '__main__':
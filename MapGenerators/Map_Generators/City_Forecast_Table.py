@@ -0,0 +1,176 @@
+import argparse
+import csv
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import Map_Utils as map_utils
+import GFS_Utils as gfs_utils
+import Dataset_Utils as dataset_utils
+import Grib_Utils as grib_utils
+import Field_Transforms as field_transforms
+Utils = map_utils.Utils()
+
+# One row per city and valid time, values the sources do not cover are NaN
+TABLE_DTYPE = np.dtype([
+    ('city', 'U32'),
+    ('lat', 'f4'),
+    ('lon', 'f4'),
+    ('valid_time', 'datetime64[s]'),
+    ('temperature', 'f4'),  # GFS surface temperature (°F)
+    ('high', 'f4'),  # NDFD daily maximum temperature (°F)
+    ('low', 'f4'),  # NDFD daily minimum temperature (°F)
+    ('pop', 'f4'),  # NDFD probability of 0.01 inch of precipitation (%)
+])
+
+# NDFD parameter name -> table column
+NDFD_COLUMNS = {
+    'Maximum temperature': 'high',
+    'Minimum temperature': 'low',
+    'Probability of 0.01 inch of precipitation (POP)': 'pop',
+}
+
+# Temperature columns are written in °F, the POP column as the percentage NDFD stores
+TRANSFORMS = {
+    'temperature': [field_transforms.kelvin_to_fahrenheit],
+    'high': [field_transforms.kelvin_to_fahrenheit],
+    'low': [field_transforms.kelvin_to_fahrenheit],
+    'pop': [],
+}
+
+
+def main():
+    # Parse the arguments from the command line
+    parser = argparse.ArgumentParser(description='Write the forecast of every city as a table, without drawing maps.')
+    parser.add_argument('-m', '--map', help='Which map\'s cities to include.')
+    parser.add_argument('-t', '--time', nargs='+', help='GFS forecast hours from now to include.', type=int,
+                        default=[0])
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Fetch all requested hours with a single time range request.')
+    parser.add_argument('-p', '--points', action='store_true',
+                        help='Request the GFS values at each city with NCSS point queries instead of a gridded box.')
+    parser.add_argument('-s', '--sources', nargs='+', choices=['gfs', 'ndfd'], default=['gfs', 'ndfd'],
+                        help='Which datasets to read.')
+    parser.add_argument('-f', '--format', choices=['csv', 'npy'], default='csv', help='Format of the table.')
+    parser.add_argument('-o', '--output', help='File to write the table to.')
+    args = parser.parse_args()
+
+    if args.map == 'verywide':
+        maps = [map_utils.VeryWide()]
+    elif args.map == 'regional':
+        maps = [map_utils.Regional()]
+    elif args.map == 'local':
+        maps = [map_utils.Local()]
+    elif args.map == 'all':
+        maps = [map_utils.VeryWide(), map_utils.Regional(), map_utils.Local()]
+    else:
+        print("Invalid Map Type Requested.")
+        return
+
+    cities = get_cities(maps)
+    rows = {}
+
+    if 'ndfd' in args.sources:
+        # Start the dataset download before the GFS requests so both transfer at the same time
+        download = dataset_utils.acquire_datasets_in_background(['NDFD'])
+    if 'gfs' in args.sources:
+        times = [datetime.utcnow() + timedelta(hours=t) for t in args.time]
+        if args.points:
+            add_gfs_point_rows(rows, cities, times)
+        else:
+            add_gfs_rows(rows, cities, maps, times, args.batch)
+    if 'ndfd' in args.sources:
+        result = download.result()['NDFD']
+        if result.status == 'failed':
+            print('NDFD dataset download failed: {}'.format(result.error))
+        if result.available:
+            add_ndfd_rows(rows, cities, result.path)
+
+    table = build_table(rows, cities)
+    output = args.output or 'City_Forecast_Table.{}'.format(args.format)
+    if args.format == 'csv':
+        write_csv(table, output)
+    else:
+        np.save(output, table)
+    print('Wrote {} rows to {}'.format(len(table), output))
+
+
+def get_cities(maps):
+    """Return the cities of all `maps`, each city once."""
+    cities = []
+    seen = set()
+    for map_ in maps:
+        for city in map_.cities:
+            key = (city.city_name, city.lat, city.lon)
+            if key not in seen:
+                seen.add(key)
+                cities.append(city)
+    return cities
+
+
+def get_row(rows, city_index, valid_time):
+    key = (city_index, np.datetime64(valid_time, 's'))
+    if key not in rows:
+        rows[key] = {'temperature': np.nan, 'high': np.nan, 'low': np.nan, 'pop': np.nan}
+    return rows[key]
+
+
+def add_gfs_rows(rows, cities, maps, times, batch):
+    # One request for the box enclosing every map, the cities are sampled from it
+    frames = gfs_utils.get_frames(['Temperature_surface'], gfs_utils.enclosing_box(maps), times, batch=batch)
+    locations = [(city.lat, city.lon) for city in cities]
+    for frame in frames:
+        sampler = gfs_utils.PointSampler.for_grid(frame.latitudes, frame.longitudes, locations)
+        temperatures = field_transforms.apply(sampler.sample(frame.fields['Temperature_surface']),
+                                              TRANSFORMS['temperature'])
+        for city_index, temperature in enumerate(temperatures):
+            get_row(rows, city_index, frame.valid_time)['temperature'] = temperature
+
+
+def add_gfs_point_rows(rows, cities, times):
+    # One point request per city covers every time, no grid is downloaded
+    series = gfs_utils.get_point_series(['Temperature_surface'], [(city.lat, city.lon) for city in cities], times)
+    for city_index, city_series in enumerate(series):
+        temperatures = field_transforms.apply(city_series['Temperature_surface'], TRANSFORMS['temperature'])
+        # Rows are keyed on the valid time of the model step the values belong to, like the frames' valid_time in
+        # add_gfs_rows
+        for valid_time, temperature in zip(city_series['time'], temperatures):
+            get_row(rows, city_index, valid_time)['temperature'] = temperature
+
+
+def add_ndfd_rows(rows, cities, path):
+    # The index lists every message, so the fields are read in one pass without decoding the others
+    index = grib_utils.GribIndex.load(path)
+    store = grib_utils.FieldStore(index)
+    locations = [(city.lat, city.lon) for city in cities]
+    for name, column in NDFD_COLUMNS.items():
+        for entry in index.select(name=name):
+            values = field_transforms.apply(store.sample(entry, locations), TRANSFORMS[column], copy=False)
+            for city_index, value in enumerate(values):
+                get_row(rows, city_index, entry['validDate'])[column] = value
+
+
+def build_table(rows, cities):
+    """Return `rows` as a structured array sorted by city and valid time."""
+    table = np.zeros(len(rows), dtype=TABLE_DTYPE)
+    for i, ((city_index, valid_time), values) in enumerate(sorted(rows.items(), key=lambda item: item[0])):
+        city = cities[city_index]
+        table[i] = (city.city_name, city.lat, city.lon, valid_time,
+                    values['temperature'], values['high'], values['low'], values['pop'])
+    return table
+
+
+def write_csv(table, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(table.dtype.names)
+        for row in table:
+            values = ['' if np.isnan(row[column]) else '{:.1f}'.format(row[column])
+                      for column in ('temperature', 'high', 'low', 'pop')]
+            writer.writerow([row['city'], '{:.4f}'.format(row['lat']), '{:.4f}'.format(row['lon']),
+                             str(row['valid_time'])] + values)
+
+
+if __name__ == '__main__':
+    Utils.create_output_directory()
+    main()
@@ -19,6 +19,9 @@ NEWSPIDER_MODULE = 'DailyHighsLowsPerChanceOfRain.spiders'
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
+# Run on the asyncio reactor so the spiders can await the shared AsyncDownloader
+TWISTED_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 #CONCURRENT_REQUESTS = 32
 
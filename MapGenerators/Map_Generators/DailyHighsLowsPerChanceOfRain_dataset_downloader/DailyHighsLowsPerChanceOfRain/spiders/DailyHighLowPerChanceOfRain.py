@@ -1,14 +1,24 @@
-import urllib.error
-import urllib.request
+import os
+import sys
 
 import scrapy
 
+# The download engine lives with the map generators, three folders up from the spiders
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+import Map_Utils as map_utils
+import Download_Utils as download_utils
+Utils = map_utils.Utils()
+
 
 class DailyHighLowPerChanceOfRain(scrapy.Spider):
     name = "DailyHighLowPerChanceOfRain"
 
+    # The NDFD file is fetched without blocking the reactor
+    downloader = download_utils.AsyncDownloader()
+
     def start_requests(self):
-        start_url = 'https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/NWS/CONUS/NOAAPORT/latest.html'
+        start_url = Utils.resolve_url(
+            'https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/NWS/CONUS/NOAAPORT/latest.html')
         yield scrapy.Request(start_url, callback=self.parse, meta={'start_url': start_url})
 
     def parse(self, response):
@@ -18,13 +28,13 @@ class DailyHighLowPerChanceOfRain(scrapy.Spider):
 
         yield scrapy.Request(url, callback=self.download_data)
 
-    def download_data(self, response):
-        base_url = 'https://tds.scigw.unidata.ucar.edu'
+    async def download_data(self, response):
+        base_url = Utils.resolve_url('https://tds.scigw.unidata.ucar.edu')
         dl_links = response.css('html body ol li a::attr(href)').getall()
         for link in dl_links:
             if 'fileServer' in link:
                 download_link = base_url + link
         try:
-            urllib.request.urlretrieve(download_link, '../../../output/DHLPCoR_data.grb2')
-        except urllib.error.URLError:
+            await self.downloader.sync_file(download_link, '../../../output/DHLPCoR_data.grb2')
+        except download_utils.AsyncDownloader.retry_exceptions:
             print('Dataset download link not found.')
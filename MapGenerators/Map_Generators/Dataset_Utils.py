@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from siphon.catalog import TDSCatalog
+
+import Map_Utils as map_utils
+import Download_Utils as download_utils
+Utils = map_utils.Utils()
+
+
+"""
+    SPC, CPC and NDFD datasets on THREDDS, with the file each one is saved to
+"""
+DATASETS = {
+    'SPC': ('https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/SPC/CONUS/latest.xml',
+            'SPC_data.grb2'),
+    'CPC': ('https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/CPC/CONUS/latest.xml',
+            'CPC_data.grb2'),
+    'NDFD': ('https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/NWS/CONUS/NOAAPORT/latest.xml',
+             'DHLPCoR_data.grb2'),
+}
+
+downloader = download_utils.AsyncDownloader(per_host_limit=3)
+
+
+"""
+    Class for the outcome of one dataset download
+"""
+class DatasetResult:
+    def __init__(self, name, path, status, error=None):
+        self.name = name
+        self.path = path
+        self.status = status  # 'downloaded', 'unchanged' or 'failed'
+        self.error = error
+
+    @property
+    def changed(self):
+        return self.status != 'unchanged'
+
+    @property
+    def available(self):
+        return os.path.exists(self.path)
+
+
+def resolve_download_url(catalog_url):
+    """Return the HTTP file server URL of the dataset a `latest.xml` catalog points to."""
+    download_utils.set_siphon_timeout(downloader.timeout)
+    catalog = TDSCatalog(Utils.resolve_url(catalog_url))
+    return Utils.resolve_access_url(catalog.datasets[0].access_urls['HTTPServer'], catalog_url)
+
+
+async def acquire(name, directory):
+    catalog_url, file_name = DATASETS[name]
+    path = os.path.join(directory, file_name)
+    try:
+        download_url = await downloader.run(catalog_url, resolve_download_url, catalog_url)
+        changed = await downloader.sync_file(download_url, path)
+    except Exception as e:
+        # Any error, a malformed catalog included, leaves this dataset failed without stopping the others
+        return DatasetResult(name, path, 'failed', e)
+    return DatasetResult(name, path, 'downloaded' if changed else 'unchanged')
+
+
+def acquire_datasets(names, directory='../output'):
+    """Resolve and download the datasets in `names` concurrently and return a {name: DatasetResult} dict."""
+    results = download_utils.run_all([acquire(name, directory) for name in names])
+    return dict(zip(names, results))
+
+
+def acquire_datasets_in_background(names, directory='../output'):
+    """
+    Start acquire_datasets in a worker thread and return its Future, so a generator can do its set up
+    while the files download and only wait on `.result()` when it needs the data.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(acquire_datasets, names, directory)
+    executor.shutdown(wait=False)
+    return future
@@ -0,0 +1,220 @@
+import asyncio
+import functools
+import json
+import os
+import re
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from siphon.http_util import session_manager
+
+
+"""
+    Asynchronous download engine shared by the map generators and the dataset spiders
+"""
+class AsyncDownloader:
+    # Errors worth another attempt besides 5xx answers, anything else is raised straight away. A broken
+    # stream counts as a lost connection, the next attempt resumes the part file.
+    retry_exceptions = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, per_host_limit=4, timeout=120, retries=3, backoff=2, chunk_size=1024 * 1024):
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        self._semaphores = {}
+
+    def _semaphore(self, url):
+        # Semaphores belong to one event loop, so each loop gets its own set
+        key = (asyncio.get_running_loop(), urlsplit(url).netloc)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.per_host_limit)
+        return self._semaphores[key]
+
+    async def run(self, url, function, *args):
+        """
+        Run the blocking call `function(*args)`, which talks to the host of `url`, in a worker thread.
+
+        At most `per_host_limit` calls run against the same host at once. A call that fails with a lost
+        connection, a timeout or a 5xx answer is retried up to `retries` times with exponential backoff.
+        The call has to bound its own requests, through the `timeout` argument of requests or a session
+        with a TimeoutAdapter, a worker thread cannot be cancelled from here.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(url):
+            for attempt in range(self.retries + 1):
+                try:
+                    return await loop.run_in_executor(None, functools.partial(function, *args))
+                except Exception as error:
+                    if attempt == self.retries or not self.should_retry(error):
+                        raise
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    @classmethod
+    def should_retry(cls, error):
+        # A 4xx answer will not change on the next attempt, a 5xx usually does
+        if isinstance(error, requests.HTTPError):
+            status = http_status(error)
+            return status is not None and status >= 500
+        return isinstance(error, cls.retry_exceptions)
+
+    async def sync_file(self, url, path):
+        """
+        Download `url` to `path` only if it changed since the last sync.
+
+        The DatasetManifest next to `path` remembers the URL, size, ETag and Last-Modified of the last
+        download. When the URL is the same and the local copy is intact a conditional request is sent,
+        and a 304 answer skips the transfer. Returns True when a new file was written.
+
+        Data is streamed to `path + '.part'`, which survives a failed attempt so the next one resumes
+        from the bytes already on disk with an HTTP Range request. The finished file is atomically
+        renamed to `path`, so readers never see a partial download.
+        """
+        manifest = DatasetManifest(os.path.dirname(path))
+        name = os.path.basename(path)
+        entry = manifest.get(name)
+
+        headers = {}
+        if entry and entry['url'] == url and os.path.exists(path) and os.path.getsize(path) == entry['size'] \
+                and not os.path.exists(path + '.part'):
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        validators = await self.run(url, self._download, url, path, headers)
+        changed = validators is not None
+
+        if changed:
+            # Read the manifest again, other datasets may have been synced to it during the download
+            manifest = DatasetManifest(os.path.dirname(path))
+            manifest.record(name, url=url, size=os.path.getsize(path), **validators)
+            manifest.save()
+        return changed
+
+    def _download(self, url, path, headers=None):
+        part_path = path + '.part'
+        validator_path = part_path + '.validator'
+        request_headers = dict(headers or {})
+
+        # Resume only when the part file belongs to the same version of the remote file
+        if os.path.exists(part_path) and os.path.exists(validator_path):
+            with open(validator_path) as f:
+                request_headers['If-Range'] = f.read()
+            request_headers['Range'] = 'bytes={}-'.format(os.path.getsize(part_path))
+
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=request_headers) as response:
+            if response.status_code == 304:
+                # The local copy is still current
+                return None
+            if response.status_code == 416 and 'Range' in request_headers:
+                # The part file does not fit the remote file any more, start over
+                os.remove(part_path)
+                os.remove(validator_path)
+                return self._download(url, path, headers)
+            response.raise_for_status()
+
+            # Servers that ignore the range, or whose file changed, send the whole file again
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            if mode == 'wb':
+                if validator:
+                    with open(validator_path, 'w') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+
+            validators = {'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+
+        os.replace(part_path, path)
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        return validators
+
+
+def http_status(error):
+    """Return the status code of a requests HTTPError, or None when it is unknown."""
+    if error.response is not None:
+        return error.response.status_code
+    # siphon raises its HTTPErrors without the response, the code is only in the message
+    match = re.search(r'Server Error \(\s*(\d{3})', str(error))
+    return int(match.group(1)) if match else None
+
+
+"""
+    Transport adapter giving every request sent without a timeout a default one
+"""
+class TimeoutAdapter(HTTPAdapter):
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def mount_timeout(session, timeout, **kwargs):
+    """Mount a TimeoutAdapter built with `kwargs` on `session` for HTTP and HTTPS."""
+    adapter = TimeoutAdapter(timeout, **kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def set_siphon_timeout(timeout):
+    """
+    Bound the requests of the sessions siphon creates from now on, catalogs and NCSS included, which
+    siphon sends without a timeout.
+    """
+    adapters = mount_timeout(requests.Session(), timeout).adapters
+    session_manager.set_session_options(adapters=adapters)
+
+
+"""
+    Record of the last downloaded version of every dataset in a folder
+"""
+class DatasetManifest:
+    file_name = 'datasets_manifest.json'
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.file_name)
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def record(self, name, url, size, etag, last_modified):
+        self.entries[name] = {
+            'url': url,
+            'dataset': url.rsplit('/', 1)[-1],
+            'size': size,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def run_all(coroutines):
+    """Run `coroutines` concurrently from synchronous code and return their results in order."""
+    async def gather():
+        return await asyncio.gather(*coroutines)
+    return asyncio.run(gather())
@@ -0,0 +1,35 @@
+import numpy as np
+
+
+# Unit conversions of forecast fields. Every transform takes a float32 ndarray or masked array and
+# converts its data in place with NumPy ufuncs, masked points included, so no temporary arrays are
+# created. Masks are left untouched.
+
+
+def kelvin_to_fahrenheit(values):
+    data = np.ma.getdata(values)
+    np.multiply(data, 1.8, out=data)
+    np.subtract(data, 459.67, out=data)
+    return values
+
+
+def kg_per_msquared_per_second_to_inches(values):
+    # kg/m^2/s of water -> mm per day -> inches per day
+    data = np.ma.getdata(values)
+    np.multiply(data, 86400 * 0.03937008, out=data)
+    return values
+
+
+def apply(values, transforms, copy=True):
+    """
+    Run the `transforms` chain over `values` and return the converted float32 array.
+
+    With `copy` the input is converted into a single new float32 array first, which leaves arrays shared
+    with other maps, caches or memory maps untouched. Without it an input that already is float32 is
+    converted in place.
+    """
+    if copy or values.dtype != np.float32:
+        values = values.astype(np.float32)
+    for transform in transforms:
+        transform(values)
+    return values
@@ -0,0 +1,70 @@
+import argparse
+from datetime import datetime, timedelta
+
+import Map_Utils as map_utils
+import GFS_Utils as gfs_utils
+import Geometry_Utils as geometry_utils
+import Temp_Map_Generator
+import Precip_Map_Gererator
+Utils = map_utils.Utils()
+
+# Products that can be drawn from the same GFS request
+PRODUCTS = {
+    'temperature': Temp_Map_Generator,
+    'precipitation': Precip_Map_Gererator,
+}
+
+
+def main():
+    # Draw the Natural Earth features from the local store
+    geometry_utils.FeatureStore.use_local_data()
+
+    # Parse the arguments from the command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--map', help='Which type of map to be generated.')
+    parser.add_argument('-t', '--time', nargs='+', help='Access and plot weather data X hours from now.', type=int,
+                        default=[0])
+    parser.add_argument('-p', '--products', nargs='+', choices=list(PRODUCTS), default=list(PRODUCTS),
+                        help='Which GFS products to generate.')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='Fetch all requested hours with a single time range request.')
+    args = parser.parse_args()
+
+    if args.map == 'verywide':
+        maps = [map_utils.VeryWide()]
+    elif args.map == 'regional':
+        maps = [map_utils.Regional()]
+    elif args.map == 'local':
+        maps = [map_utils.Local()]
+    elif args.map == 'tropical':
+        maps = [map_utils.Tropical()]
+    elif args.map == 'all':
+        maps = [map_utils.VeryWide(), map_utils.Regional(), map_utils.Local(), map_utils.Tropical()]
+    else:
+        print("Invalid Map Type Requested.")
+        return
+
+    # Collect the variables of every scheduled product so each time is only requested once
+    products = [PRODUCTS[name] for name in args.products]
+    variables = []
+    for product in products:
+        variables += [variable for variable in product.VARIABLES if variable not in variables]
+
+    times = [datetime.utcnow() + timedelta(hours=t) for t in args.time]  # Times of data requested
+    # Several map types share one request for the box enclosing all of them
+    frames = gfs_utils.get_frames(variables, gfs_utils.enclosing_box(maps), times, batch=args.batch)
+
+    # Hand each product its slice of the shared frames, drawn on one figure per map type and product
+    logo = Utils.get_logo()
+    for map_ in maps:
+        for product in products:
+            renderer = product.create_renderer(map_, logo)
+            for t, frame in zip(args.time, frames):
+                product.plot_map(renderer, t, gfs_utils.slice_frame(frame, map_).select(product.VARIABLES))
+            renderer.close()
+    print(gfs_utils.GFSCache.summary())
+
+
+if __name__ == '__main__':
+    Utils.create_output_directory()
+    main()
@@ -0,0 +1,406 @@
+import hashlib
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from netCDF4 import num2date
+import numpy as np
+from siphon.catalog import TDSCatalog
+from siphon.ncss import NCSS
+
+import Map_Utils as map_utils
+import Download_Utils as download_utils
+Utils = map_utils.Utils()
+
+# Downloader used for every NCSS request of a run, its per host limit stays within GFSCatalog.pool_size
+downloader = download_utils.AsyncDownloader(per_host_limit=4)
+
+
+"""
+    Shared access to the GFS 0.25 degree catalog on THREDDS
+"""
+class GFSCatalog:
+    # Catalog holding only the newest run, its dataset is named after the run's reference time. Data comes
+    # from that run alone, unlike the Best dataset which mixes in older runs, so the cache keys name it exactly.
+    url = 'http://thredds.ucar.edu/thredds/catalog/grib/NCEP/GFS/Global_0p25deg/latest.xml'
+
+    # Seconds a resolved catalog/NCSS handle is reused before the catalog is read again
+    ttl = 600
+
+    # Connections kept open to THREDDS by the shared HTTP session
+    pool_size = 10
+
+    _ncss = None
+    _model_run = None
+    _resolved_at = None
+
+    @classmethod
+    def get_ncss(cls):
+        """
+        Return the NCSS access point of the newest GFS run.
+
+        The catalog and the NCSS dataset metadata are only fetched when no handle exists yet or the
+        current one is older than `ttl`, so every forecast hour of a run shares the same endpoint and
+        the same pooled HTTP session.
+        """
+        now = time.monotonic()
+        if cls._ncss is None or now - cls._resolved_at > cls.ttl:
+            # siphon sends the catalog requests without a timeout of their own
+            download_utils.set_siphon_timeout(downloader.timeout)
+
+            # Acquire the newest run from the GFS Global Catalog
+            GFS_data = TDSCatalog(Utils.resolve_url(cls.url)).datasets[0]
+
+            # Get the NCSS access point used to query data from the run
+            ncss = NCSS(Utils.resolve_access_url(GFS_data.access_urls['NetcdfSubset'], cls.url))
+
+            # Let every data request reuse the keep-alive connections of one session, each bounded by the
+            # downloader's timeout
+            download_utils.mount_timeout(ncss._session, downloader.timeout,
+                                         pool_connections=cls.pool_size, pool_maxsize=cls.pool_size)
+
+            cls._ncss = ncss
+            cls._model_run = cls.read_model_run(GFS_data.name)
+            cls._resolved_at = now
+        return cls._ncss
+
+    @classmethod
+    def get_model_run(cls):
+        """
+        Return the reference time of the model run the NCSS handle serves, resolved together with the
+        handle so both are refreshed after `ttl`.
+        """
+        cls.get_ncss()
+        return cls._model_run
+
+    @staticmethod
+    def read_model_run(name):
+        # e.g. GFS_Global_0p25deg_20190801_1200.grib2 -> 2019-08-01T12:00
+        match = re.search(r'(\d{8})_(\d{4})', name)
+        if match is None:
+            # Still names exactly one run, only not as a time
+            return name
+        return datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M').isoformat()
+
+
+"""
+    Persistent on-disk cache of GFS subsets
+"""
+class GFSCache:
+    directory = 'gfs'
+
+    # Eviction limits, least recently used entries are removed first once the size limit is reached
+    max_bytes = 2 * 1024 ** 3
+    max_age = timedelta(days=2)
+
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def key(model_run, time, variable, box):
+        # Snap the valid time to the hour so reruns a few minutes apart share their entries
+        valid_time = (time + timedelta(minutes=30)).replace(minute=0, second=0, microsecond=0)
+        key = '{}|{}|{}|{}'.format(model_run, valid_time.isoformat(), variable, ','.join(str(b) for b in box))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @classmethod
+    def path(cls, model_run, time, variable, box):
+        return os.path.join(Utils.get_cache_directory(cls.directory),
+                            cls.key(model_run, time, variable, box) + '.npz')
+
+    @classmethod
+    def load(cls, model_run, time, variable, box):
+        """Return (values, latitudes, longitudes, valid time) of a cached field or None on a miss."""
+        path = cls.path(model_run, time, variable, box)
+        try:
+            with np.load(path) as cached:
+                values = np.ma.masked_array(cached['values'], mask=cached['mask'])
+                latitudes = cached['latitudes']
+                longitudes = cached['longitudes']
+                valid_time = cached['valid_time'][()]
+        except (OSError, KeyError, ValueError):
+            cls.misses += 1
+            return None
+
+        # Mark the entry as recently used for the LRU eviction
+        os.utime(path)
+        cls.hits += 1
+        return values, latitudes, longitudes, valid_time
+
+    @classmethod
+    def store(cls, model_run, time, variable, box, values, latitudes, longitudes, valid_time):
+        path = cls.path(model_run, time, variable, box)
+
+        # Write next to the final file and rename so an interrupted run never leaves a partial entry
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, values=np.ma.getdata(values), mask=np.ma.getmaskarray(values),
+                     latitudes=np.asarray(latitudes), longitudes=np.asarray(longitudes),
+                     valid_time=np.datetime64(valid_time, 's'))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def evict(cls):
+        """Remove entries older than `max_age`, then the least recently used ones above `max_bytes`."""
+        directory = Utils.get_cache_directory(cls.directory)
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            if datetime.now().timestamp() - stat.st_mtime > cls.max_age.total_seconds():
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= cls.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    @classmethod
+    def summary(cls):
+        return 'GFS cache: {} hits, {} misses'.format(cls.hits, cls.misses)
+
+
+"""
+    Class for one forecast time worth of GFS fields
+"""
+class GFSFrame:
+    def __init__(self, time, fields, latitudes, longitudes, valid_time=None):
+        self.time = time  # Time the frame was requested for
+        self.fields = fields
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.valid_time = valid_time  # Valid time of the model output step the fields belong to
+
+    def select(self, variables):
+        """Return a frame sharing this frame's grid with only `variables` in its fields."""
+        return GFSFrame(self.time, {variable: self.fields[variable] for variable in variables},
+                        self.latitudes, self.longitudes, self.valid_time)
+
+
+def lonlat_box(map_):
+    """Return the [north, south, east, west] box queried for a map, tropical maps reach 10 degrees further north."""
+    north, south, east, west = map_.NorthSouthEastWest
+    if map_.map_type == 'tropical':
+        north += 10
+    return [north, south, east, west]
+
+
+def enclosing_box(maps):
+    """Return the smallest [north, south, east, west] box containing the query box of every map."""
+    boxes = [lonlat_box(map_) for map_ in maps]
+    return [max(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), min(box[3] for box in boxes)]
+
+
+def slice_frame(frame, map_):
+    """
+    Cut the query box of `map_` out of a frame fetched for a larger box.
+
+    Only basic slicing is used, so the returned fields and coordinates are views into the frame's
+    arrays rather than copies.
+    """
+    north, south, east, west = lonlat_box(map_)
+    longitudes = np.where(frame.longitudes > 180, frame.longitudes - 360, frame.longitudes)
+
+    rows = np.nonzero((frame.latitudes <= north) & (frame.latitudes >= south))[0]
+    cols = np.nonzero((longitudes <= east) & (longitudes >= west))[0]
+    rows = slice(rows.min(), rows.max() + 1)
+    cols = slice(cols.min(), cols.max() + 1)
+
+    fields = {variable: values[rows, cols] for variable, values in frame.fields.items()}
+    return GFSFrame(frame.time, fields, frame.latitudes[rows], frame.longitudes[cols], frame.valid_time)
+
+
+"""
+    Nearest grid point lookup of a set of locations on the regular GFS grid
+"""
+class PointSampler:
+    # (latitude axis, longitude axis, locations) -> PointSampler, axes are keyed by first value, step and size
+    samplers = {}
+
+    def __init__(self, latitudes, longitudes, locations):
+        lats = np.array([lat for lat, lon in locations], dtype=float)
+        lons = np.array([lon for lat, lon in locations], dtype=float)
+
+        # The grid is regular, so the nearest point follows from the distance to the first one
+        lat_step = latitudes[1] - latitudes[0] if len(latitudes) > 1 else 1
+        lon_step = longitudes[1] - longitudes[0] if len(longitudes) > 1 else 1
+        rows = np.rint((lats - latitudes[0]) / lat_step).astype(int)
+        # Grid longitudes run 0..360 and the locations -180..180
+        columns = np.rint(((lons - longitudes[0]) % 360) / lon_step).astype(int)
+
+        self.found = (rows >= 0) & (rows < len(latitudes)) & (columns >= 0) & (columns < len(longitudes))
+        self.rows = rows[self.found]
+        self.columns = columns[self.found]
+
+    @staticmethod
+    def axis_key(axis):
+        return (float(axis[0]), float(axis[1] - axis[0]) if len(axis) > 1 else 0.0, len(axis))
+
+    @classmethod
+    def for_grid(cls, latitudes, longitudes, locations):
+        """Return the sampler of `locations`, a list of (lat, lon) pairs, on the grid, built once per grid and locations."""
+        key = (cls.axis_key(latitudes), cls.axis_key(longitudes), tuple(locations))
+        if key not in cls.samplers:
+            cls.samplers[key] = cls(latitudes, longitudes, locations)
+        return cls.samplers[key]
+
+    def sample(self, field):
+        """Return the value of `field` at every location in one indexing operation, NaN for locations off the grid or masked."""
+        values = np.full(len(self.found), np.nan)
+        values[self.found] = np.ma.filled(field[self.rows, self.columns], np.nan)
+        return values
+
+
+def build_query(ncss, variables, box):
+    # Use the `ncss` object to create a new query object
+    query = ncss.query()
+    query.accept('netcdf4')
+    query.variables(*variables)
+
+    # Set the lat lon box for which specific area of the dataset to query
+    query.lonlat_box(north=box[0], south=box[1], east=box[2], west=box[3])
+    return query
+
+
+def get_frames(variables, box, times, batch=False):
+    """
+    Return one GFSFrame per datetime in `times` holding `variables` inside `box`.
+
+    Fields already in the GFSCache are loaded from disk, everything else is fetched from NCSS. By
+    default every time is its own NCSS request, run in parallel. With `batch` a single time range request covering
+    all the times is made and the returned netCDF is split along its time axis instead.
+    """
+    model_run = GFSCatalog.get_model_run()
+    frames = [GFSFrame(time, {}, None, None) for time in times]
+
+    # Look up every field in the cache first and only keep the misses for the network
+    missing_frames = []
+    missing_variables = []
+    for frame in frames:
+        for variable in variables:
+            cached = GFSCache.load(model_run, frame.time, variable, box)
+            if cached is None:
+                if frame not in missing_frames:
+                    missing_frames.append(frame)
+                if variable not in missing_variables:
+                    missing_variables.append(variable)
+            else:
+                frame.fields[variable], frame.latitudes, frame.longitudes, frame.valid_time = cached
+
+    if missing_frames:
+        fetched = fetch_frames(missing_variables, box, [frame.time for frame in missing_frames], batch=batch)
+        for frame, fetched_frame in zip(missing_frames, fetched):
+            frame.latitudes = fetched_frame.latitudes
+            frame.longitudes = fetched_frame.longitudes
+            frame.valid_time = fetched_frame.valid_time
+            for variable, values in fetched_frame.fields.items():
+                frame.fields.setdefault(variable, values)
+                GFSCache.store(model_run, frame.time, variable, box, values, frame.latitudes, frame.longitudes,
+                               frame.valid_time)
+        GFSCache.evict()
+    return frames
+
+
+def fetch_frames(variables, box, times, batch=False):
+    ncss = GFSCatalog.get_ncss()
+    if batch:
+        return download_utils.run_all([downloader.run(ncss.url, fetch_frames_time_range, ncss, variables, box,
+                                                      times)])[0]
+
+    # Independent forecast hours are downloaded in parallel
+    return download_utils.run_all([downloader.run(ncss.url, fetch_frame, ncss, variables, box, time)
+                                   for time in times])
+
+
+def fetch_frame(ncss, variables, box, time):
+    query = build_query(ncss, variables, box)
+    query.time(time)
+    data = ncss.get_data(query)
+
+    # Remove 1d arrays from data for plotting
+    fields = {variable: data.variables[variable][:].squeeze() for variable in variables}
+
+    # NCSS returns the model output step closest to the requested time, with its own time coordinate
+    time_var = data.variables[data.variables[variables[0]].dimensions[0]]
+    valid_time = decode_times(time_var)[0]
+    return GFSFrame(time, fields, data.variables['latitude'][:].squeeze(),
+                    data.variables['longitude'][:].squeeze(), valid_time)
+
+
+# Padding around the requested times so the range always includes the closest model output step
+TIME_RANGE_PADDING = timedelta(minutes=90)
+
+
+def fetch_frames_time_range(ncss, variables, box, times):
+    query = build_query(ncss, variables, box)
+    query.time_range(min(times) - TIME_RANGE_PADDING, max(times) + TIME_RANGE_PADDING)
+    data = ncss.get_data(query)
+
+    latitudes = data.variables['latitude'][:].squeeze()
+    longitudes = data.variables['longitude'][:].squeeze()
+
+    # Decode every variable once, the frames below are views into these arrays
+    values = {}
+    valid_times = {}
+    for variable in variables:
+        var = data.variables[variable]
+        values[variable] = var[:]
+        valid_times[variable] = decode_times(data.variables[var.dimensions[0]])
+
+    frames = []
+    for time in times:
+        fields = {}
+        steps = {}
+        for variable in variables:
+            steps[variable] = np.abs(valid_times[variable] - np.datetime64(time)).argmin()
+            fields[variable] = values[variable][steps[variable]].squeeze()
+        valid_time = valid_times[variables[0]][steps[variables[0]]]
+        frames.append(GFSFrame(time, fields, latitudes, longitudes, valid_time))
+    return frames
+
+
+def get_point_series(variables, locations, times):
+    """
+    Return a {variable: values} dict for every (lat, lon) of `locations`, with the values of the model
+    output step nearest to each datetime in `times`. The 'time' entry holds the valid times of those
+    steps as decoded from the response.
+
+    NCSS answers a grid-as-point query for a single location, so each location is one small CSV request
+    covering every time, and the requests run in parallel. Only a few kilobytes are transferred,
+    compared with the gridded box `get_frames` downloads.
+    """
+    ncss = GFSCatalog.get_ncss()
+    return download_utils.run_all([downloader.run(ncss.url, fetch_point_series, ncss, variables, lat, lon, times)
+                                   for lat, lon in locations])
+
+
+def fetch_point_series(ncss, variables, lat, lon, times):
+    query = ncss.query()
+    query.accept('csv')
+    query.variables(*variables)
+    query.lonlat_point(lon, lat)
+    query.time_range(min(times) - TIME_RANGE_PADDING, max(times) + TIME_RANGE_PADDING)
+    data = ncss.get_data(query)
+
+    # Siphon hands CSV columns back as arrays, with the times as ISO 8601 strings. numpy before 2.0 reads them
+    # as bytes, which have to be decoded before the trailing Z can be removed.
+    valid_times = np.array([(time.decode() if isinstance(time, bytes) else str(time)).rstrip('Z')
+                            for time in np.atleast_1d(data['time'])], dtype='datetime64[s]')
+    steps = np.array([np.abs(valid_times - np.datetime64(time, 's')).argmin() for time in times])
+    series = {'time': valid_times[steps]}
+    for variable in variables:
+        series[variable] = np.atleast_1d(data[variable])[steps]
+    return series
+
+
+def decode_times(time_var):
+    """Convert a netCDF time coordinate into an array of numpy datetimes."""
+    dates = num2date(time_var[:], time_var.units, only_use_cftime_datetimes=False,
+                     only_use_python_datetimes=True)
+    return np.array(dates, dtype='datetime64[s]')
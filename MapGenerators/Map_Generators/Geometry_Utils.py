@@ -0,0 +1,335 @@
+import json
+import os
+
+import cartopy
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import cartopy.io.shapereader as shpreader
+import matplotlib.image as mpimg
+from matplotlib.figure import Figure
+from shapely import wkb
+from shapely.geometry import GeometryCollection, box
+from shapely.strtree import STRtree
+
+import Map_Utils as map_utils
+Utils = map_utils.Utils()
+
+
+"""
+    County outlines cut down to each map type and stored pre-projected
+"""
+class CountyCache:
+    directory = 'geometry'
+    shapefile = '../county_data/countyl010g.shp'
+
+    # Width in pixels of the saved maps (15 inch figures at 100 dpi), outlines are simplified to one pixel
+    output_width = 1500
+
+    # Every county in the shapefile and their spatial index, read at most once per process
+    counties = None
+    tree = None
+
+    # Map type -> ShapelyFeature of the counties on that map
+    features = {}
+
+    @classmethod
+    def feature(cls, map_):
+        """
+        Return a ShapelyFeature of the counties that intersect `map_`, in the Mercator projection of the maps.
+
+        The counties are picked, simplified and projected once per map type and saved as WKB in the geometry
+        cache, later runs load that file instead of the shapefile. The file is rebuilt when the shapefile or
+        the map's extent changes.
+        """
+        if map_.map_type not in cls.features:
+            geometries = cls._load(map_)
+            if geometries is None:
+                geometries = cls._build(map_)
+            cls.features[map_.map_type] = cfeature.ShapelyFeature(geometries, ccrs.Mercator())
+        return cls.features[map_.map_type]
+
+    @classmethod
+    def _paths(cls, map_):
+        directory = Utils.get_cache_directory(cls.directory)
+        path = os.path.join(directory, 'counties_{}'.format(map_.map_type))
+        return path + '.wkb', path + '.json'
+
+    @classmethod
+    def _stamp(cls, map_):
+        stat = os.stat(cls.shapefile)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime, 'extent': list(map_.NorthSouthEastWest),
+                'output_width': cls.output_width}
+
+    @classmethod
+    def _load(cls, map_):
+        wkb_path, stamp_path = cls._paths(map_)
+        try:
+            with open(stamp_path) as f:
+                if json.load(f) != cls._stamp(map_):
+                    return None
+            with open(wkb_path, 'rb') as f:
+                return list(wkb.loads(f.read()).geoms)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def _build(cls, map_):
+        if cls.counties is None:
+            cls.counties = list(shpreader.Reader(cls.shapefile).geometries())
+            cls.tree = STRtree(cls.counties)
+
+        north, south, east, west = map_.NorthSouthEastWest
+        indices = cls.tree.query(box(west, south, east, north), predicate='intersects')
+
+        # Simplify in projected metres so the tolerance follows the size of a pixel on this map
+        projection = ccrs.Mercator()
+        x_min, _ = projection.transform_point(west, south, ccrs.PlateCarree())
+        x_max, _ = projection.transform_point(east, south, ccrs.PlateCarree())
+        tolerance = (x_max - x_min) / cls.output_width
+
+        geometries = []
+        for i in sorted(indices):
+            projected = projection.project_geometry(cls.counties[i], ccrs.PlateCarree())
+            geometries.append(projected.simplify(tolerance, preserve_topology=True))
+
+        wkb_path, stamp_path = cls._paths(map_)
+        for path, mode, content in ((wkb_path, 'wb', wkb.dumps(GeometryCollection(geometries))),
+                                    (stamp_path, 'w', json.dumps(cls._stamp(map_)))):
+            temp_path = path + '.tmp'
+            with open(temp_path, mode) as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        return geometries
+
+
+"""
+    Natural Earth features read from a local copy, one instance per feature and scale
+"""
+class FeatureStore:
+    # Seeded once with Seed_Natural_Earth.py, the maps then draw without network access
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'natural_earth')
+
+    # Natural Earth scale drawn on every map type, finer for the maps showing a smaller area
+    scales = {
+        'country': '110m',
+        'tropical': '110m',
+        'verywide': '50m',
+        'regional': '50m',
+        'local': '10m',
+    }
+
+    # Feature name -> (category, Natural Earth name, default style), styled like cartopy's own features
+    named = {
+        'states': ('cultural', 'admin_1_states_provinces_lakes', {'edgecolor': 'black', 'facecolor': 'none'}),
+        'state_lines': ('cultural', 'admin_1_states_provinces_lines', {'edgecolor': 'black', 'facecolor': 'none'}),
+        'countries': ('cultural', 'admin_0_countries', {'edgecolor': 'black', 'facecolor': 'none'}),
+        'land': ('physical', 'land', {'edgecolor': 'face', 'facecolor': cfeature.COLORS['land'], 'zorder': -1}),
+        'ocean': ('physical', 'ocean', {'edgecolor': 'face', 'facecolor': cfeature.COLORS['water'], 'zorder': -1}),
+        'coastline': ('physical', 'coastline', {'edgecolor': 'black', 'facecolor': 'none'}),
+    }
+
+    # (category, name, scale) -> NaturalEarthFeature
+    features = {}
+
+    @classmethod
+    def use_local_data(cls):
+        # cartopy reads the shapefiles from the store first, anything missing is downloaded into it. This
+        # changes cartopy's global config, so it is called from the scripts' main() rather than on import.
+        cartopy.config['pre_existing_data_dir'] = cls.directory
+        cartopy.config['data_dir'] = cls.directory
+
+    @classmethod
+    def feature(cls, name, map_type):
+        """
+        Return the Natural Earth feature `name` (see `named`) at the scale of `map_type`.
+
+        The same feature instance is handed out for every frame and map of a process. cartopy parses its
+        shapefile the first time it is drawn and keeps the geometries for the rest of the process.
+        """
+        category, natural_earth_name, style = cls.named[name]
+        key = (category, natural_earth_name, cls.scales[map_type])
+        if key not in cls.features:
+            cls.features[key] = cfeature.NaturalEarthFeature(*key, **style)
+        return cls.features[key]
+
+    @classmethod
+    def seed(cls):
+        """Download every feature the maps use, at every scale, into the store and return the shapefile paths."""
+        cls.use_local_data()
+        paths = []
+        for category, natural_earth_name, _ in cls.named.values():
+            for scale in sorted(set(cls.scales.values())):
+                paths.append(shpreader.natural_earth(resolution=scale, category=category, name=natural_earth_name))
+        return paths
+
+
+"""
+    Static layers of every map type pre-rendered to georeferenced rasters
+"""
+class Basemap:
+    directory = 'basemaps'
+
+    # Bump when the way layers are drawn changes, so every basemap is rendered again
+    version = 2
+
+    # Width in pixels of the rendered layers, the height follows from the map's extent
+    width = CountyCache.output_width
+    dpi = 100
+
+    # Layers shared by the layer sets below, as (feature, style)
+    states = ('states', {'linewidth': 0.5})
+    counties = ('counties', {'facecolor': 'none', 'edgecolor': 'black', 'linewidth': 0.3})
+    countries = ('countries', {'edgecolor': 'black', 'linewidth': 0.5})
+    ocean = ('ocean', {})
+    land = ('land', {})
+
+    # Layer set -> map type -> layers drawn under the data (fills) and over it (outlines). Each set keeps
+    # the layers its generators drew before they used basemaps, so the maps look the same.
+    layer_sets = {
+        # Temperature and precipitation, no ocean and land fills except on the tropical map
+        'gfs': {
+            'verywide': {'under': [], 'over': [states]},
+            'regional': {'under': [], 'over': [states, counties]},
+            'local': {'under': [], 'over': [states, counties]},
+            'tropical': {'under': [land], 'over': [states, countries]},
+            'country': {'under': [], 'over': [states]},
+        },
+        # SPC and CPC outlooks, land is only filled on the tropical and country maps
+        'outlook': {
+            'verywide': {'under': [ocean], 'over': [states]},
+            'regional': {'under': [ocean], 'over': [states, counties]},
+            'local': {'under': [ocean], 'over': [states, counties]},
+            'tropical': {'under': [ocean, land], 'over': [countries, states]},
+            'country': {'under': [ocean, land], 'over': [countries, states]},
+        },
+        # Daily highs/lows, the states are filled with the land colour
+        'ndfd': {
+            'verywide': {'under': [ocean, ('states', {'facecolor': cfeature.COLORS['land'], 'edgecolor': 'none'})],
+                         'over': [states]},
+            'regional': {'under': [ocean, ('states', {'facecolor': cfeature.COLORS['land'], 'edgecolor': 'none'})],
+                         'over': [states, counties]},
+            'local': {'under': [ocean, ('states', {'facecolor': cfeature.COLORS['land'], 'edgecolor': 'none'})],
+                      'over': [states, counties]},
+            'tropical': {'under': [ocean, land], 'over': [countries]},
+            'country': {'under': [ocean], 'over': []},
+        },
+    }
+
+    # Drawing order of the two rasters, the filled contours (zorder 1) sit between them and the labels above both
+    zorders = {'under': 0, 'over': 2}
+
+    # (layer set, map type) -> (metadata, {side: RGBA array}) loaded in this process
+    loaded = {}
+
+    @classmethod
+    def layers(cls, layer_set, map_):
+        """Return the {side: layers} of `map_` in `layer_set`, leaving out the sides with nothing to draw."""
+        return {side: layers for side, layers in cls.layer_sets[layer_set][map_.map_type].items() if layers}
+
+    @classmethod
+    def _paths(cls, layer_set, map_):
+        path = os.path.join(Utils.get_cache_directory(cls.directory), '{}_{}'.format(layer_set, map_.map_type))
+        return {'under': path + '_under.png', 'over': path + '_over.png', 'metadata': path + '.json'}
+
+    @classmethod
+    def stamp(cls, layer_set, map_):
+        """Everything a basemap is rendered from, a change in any of it renders the basemap again."""
+        layers = cls.layers(layer_set, map_)
+        stamp = {
+            'version': cls.version,
+            'layer_set': layer_set,
+            'map_type': map_.map_type,
+            'extent': list(map_.NorthSouthEastWest),
+            'layers': layers,
+            'scale': FeatureStore.scales[map_.map_type],
+            'width': cls.width,
+        }
+        # Only basemaps that draw counties depend on the county shapefile
+        if any(name == 'counties' for side in layers.values() for name, _ in side):
+            stat = os.stat(CountyCache.shapefile)
+            stamp['shapefile'] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        # Compare in the form it takes in the JSON file
+        return json.loads(json.dumps(stamp))
+
+    @classmethod
+    def is_current(cls, layer_set, map_):
+        paths = cls._paths(layer_set, map_)
+        try:
+            with open(paths['metadata']) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return metadata.get('stamp') == cls.stamp(layer_set, map_) \
+            and all(os.path.exists(paths[side]) for side in cls.layers(layer_set, map_))
+
+    @classmethod
+    def feature(cls, name, map_):
+        if name == 'counties':
+            return CountyCache.feature(map_)
+        return FeatureStore.feature(name, map_.map_type)
+
+    @classmethod
+    def build(cls, layer_set, map_, force=False):
+        """
+        Render the static layers of `map_` in `layer_set` to transparent PNGs in the basemap cache, unless
+        they are already current. A JSON file next to them holds the Mercator extent of the rasters and the
+        stamp they were rendered from.
+        """
+        if not force and cls.is_current(layer_set, map_):
+            return False
+
+        projection = ccrs.Mercator()
+        north, south, east, west = map_.NorthSouthEastWest
+        x_min, y_min = projection.transform_point(west, south, ccrs.Geodetic())
+        x_max, y_max = projection.transform_point(east, north, ccrs.Geodetic())
+        height = int(round(cls.width * (y_max - y_min) / (x_max - x_min)))
+
+        paths = cls._paths(layer_set, map_)
+        extent = None
+        for side, layers in cls.layers(layer_set, map_).items():
+            # The axes fill the whole figure, so the image covers exactly the map's extent
+            fig = Figure(figsize=(cls.width / cls.dpi, height / cls.dpi), dpi=cls.dpi)
+            ax = fig.add_axes([0, 0, 1, 1], projection=projection)
+            ax.set_extent(map_.NorthSouthEastWest[::-1], crs=ccrs.Geodetic())
+            ax.spines['geo'].set_visible(False)
+            ax.patch.set_visible(False)
+            for name, style in layers:
+                ax.add_feature(cls.feature(name, map_), **style)
+
+            temp_path = paths[side] + '.tmp.png'
+            fig.savefig(temp_path, dpi=cls.dpi, transparent=True)
+            os.replace(temp_path, paths[side])
+            extent = list(ax.get_extent(crs=projection))
+
+        metadata = {'projection': 'Mercator', 'extent': extent, 'stamp': cls.stamp(layer_set, map_)}
+        temp_path = paths['metadata'] + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(temp_path, paths['metadata'])
+        cls.loaded.pop((layer_set, map_.map_type), None)
+        return True
+
+    @classmethod
+    def load(cls, layer_set, map_):
+        """Return the (metadata, rasters) of `map_` in `layer_set`, rendering them first when missing or out of date."""
+        key = (layer_set, map_.map_type)
+        if key not in cls.loaded:
+            cls.build(layer_set, map_)
+            paths = cls._paths(layer_set, map_)
+            with open(paths['metadata']) as f:
+                metadata = json.load(f)
+            rasters = {side: mpimg.imread(paths[side]) for side in cls.layers(layer_set, map_)}
+            cls.loaded[key] = (metadata, rasters)
+        return cls.loaded[key]
+
+    @classmethod
+    def add_to(cls, ax, map_, layer_set):
+        """Composite the basemap of `map_` in `layer_set` onto `ax`, a Mercator GeoAxes set to the map's extent."""
+        metadata, rasters = cls.load(layer_set, map_)
+        for side, raster in rasters.items():
+            # The raster is wider than the axes, antialiased resampling is made for downsampling while
+            # bilinear interpolation blurred the thin county lines
+            ax.imshow(raster, origin='upper', extent=metadata['extent'], transform=ccrs.Mercator(),
+                      interpolation='antialiased', zorder=cls.zorders[side])
+        # imshow fits the view to the image, put the map's own extent back
+        ax.set_extent(map_.NorthSouthEastWest[::-1], crs=ccrs.Geodetic())
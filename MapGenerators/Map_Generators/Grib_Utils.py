@@ -0,0 +1,386 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pygrib
+from scipy.spatial import cKDTree
+
+import Map_Utils as map_utils
+Utils = map_utils.Utils()
+
+
+"""
+    Sidecar index of the messages in a GRIB file
+"""
+class GribIndex:
+    # Bump when the entry layout changes so older sidecars are rebuilt
+    version = 3
+
+    # GRIB2 probability types grouped by the side of the threshold they describe
+    events = {0: 'below', 4: 'below', 1: 'above', 3: 'above', 2: 'between'}
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+
+    @staticmethod
+    def sidecar_path(path):
+        return path + '.idx.json'
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return the index of the GRIB file at `path`.
+
+        The index is read from the `.idx.json` sidecar next to the file and only rebuilt, with a single
+        pass over the message headers, when the file's size or modification time changed.
+        """
+        stat = os.stat(path)
+        try:
+            with open(cls.sidecar_path(path)) as f:
+                sidecar = json.load(f)
+            if sidecar['version'] == cls.version and sidecar['size'] == stat.st_size \
+                    and sidecar['mtime'] == stat.st_mtime:
+                entries = sidecar['entries']
+                for entry in entries:
+                    entry['validDate'] = datetime.fromisoformat(entry['validDate'])
+                return cls(path, entries)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = cls(path, cls.build_entries(path))
+        index.save(stat)
+        return index
+
+    @classmethod
+    def build_entries(cls, path):
+        entries = []
+        grbs = pygrib.open(path)
+        for message in grbs:
+            probability_type = message['probabilityType'] if message.has_key('probabilityType') else None
+            entries.append({
+                'number': message.messagenumber,
+                'offset': message['offset'],
+                'length': message['totalLength'],
+                'name': message.name,
+                'parameterName': message['parameterName'],
+                'probabilityType': probability_type,
+                'lowerLimit': message['lowerLimit'] if message.has_key('lowerLimit') else None,
+                'upperLimit': message['upperLimit'] if message.has_key('upperLimit') else None,
+                'event': cls.events.get(probability_type),
+                'periodHours': message['endStep'] - message['startStep'],
+                'validDate': message.validDate,
+                'grid': GridCache.grid_hash(message),
+            })
+        grbs.close()
+
+        # Number the forecast days of every parameter in valid date order
+        for name in set(entry['name'] for entry in entries):
+            valid_dates = sorted(set(entry['validDate'] for entry in entries if entry['name'] == name))
+            for entry in entries:
+                if entry['name'] == name:
+                    entry['day'] = valid_dates.index(entry['validDate']) + 1
+        return entries
+
+    def save(self, stat):
+        entries = [dict(entry, validDate=entry['validDate'].isoformat()) for entry in self.entries]
+        sidecar = {'version': self.version, 'size': stat.st_size, 'mtime': stat.st_mtime, 'entries': entries}
+        temp_path = self.sidecar_path(self.path) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(sidecar, f)
+        os.replace(temp_path, self.sidecar_path(self.path))
+
+    def select(self, **criteria):
+        """Return the entries whose keys equal every keyword in `criteria`, in file order."""
+        return [entry for entry in self.entries
+                if all(entry.get(key) == value for key, value in criteria.items())]
+
+    def read(self, entry):
+        """Decode only the message of `entry`, reading its bytes straight from its offset."""
+        with open(self.path, 'rb') as f:
+            f.seek(entry['offset'])
+            return pygrib.fromstring(f.read(entry['length']))
+
+    def latlons(self, entry):
+        """Return the shared lat/lon arrays of `entry`'s grid, decoding the message only on a cache miss."""
+        if entry['grid'] in GridCache.grids:
+            return GridCache.grids[entry['grid']]
+        return GridCache.latlons(self.read(entry))
+
+
+"""
+    Lat/lon geometry of GRIB grids, computed once per grid definition
+"""
+class GridCache:
+    directory = 'grids'
+
+    # Grid hash -> (lats, lons) for every grid used in this process
+    grids = {}
+
+    # (grid hash, box, margin) -> (row slice, column slice) of the grid covering a map
+    windows = {}
+
+    @staticmethod
+    def grid_hash(message):
+        # ecCodes' checksum of the grid definition section, identical for every message on the same grid
+        return message['md5Section3']
+
+    @classmethod
+    def latlons(cls, message):
+        """
+        Return read-only (lats, lons) arrays for the grid of `message`.
+
+        Every message on the same grid shares the same arrays. They are also saved as .npy files in
+        the grid cache folder and memory mapped, so later runs skip the computation.
+        """
+        grid_hash = cls.grid_hash(message)
+        if grid_hash not in cls.grids:
+            cls.grids[grid_hash] = cls._load(message, grid_hash)
+        return cls.grids[grid_hash]
+
+    @classmethod
+    def _load(cls, message, grid_hash):
+        directory = Utils.get_cache_directory(cls.directory)
+        paths = [os.path.join(directory, '{}_{}.npy'.format(grid_hash, name)) for name in ('lats', 'lons')]
+        if all(os.path.exists(path) for path in paths):
+            return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+        arrays = message.latlons()
+        for path, array in zip(paths, arrays):
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, path)
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+    @classmethod
+    def window(cls, grid_hash, lats, lons, box, margin=1.0):
+        """
+        Return the (row slice, column slice) of the smallest part of the grid covering `box`, a map's
+        [north, south, east, west] in degrees, widened by `margin` degrees so contours reach the edges.
+
+        Computed once per grid and box. A box that misses the grid altogether gets the whole grid.
+        """
+        key = (grid_hash, tuple(box), margin)
+        if key not in cls.windows:
+            north, south, east, west = box
+            # GRIB longitudes run 0..360, the maps use -180..180
+            lons = (np.asarray(lons) + 180) % 360 - 180
+            inside = (lats >= south - margin) & (lats <= north + margin) \
+                & (lons >= west - margin) & (lons <= east + margin)
+            rows = np.flatnonzero(inside.any(axis=1))
+            columns = np.flatnonzero(inside.any(axis=0))
+            if rows.size == 0:
+                cls.windows[key] = (slice(None), slice(None))
+            else:
+                cls.windows[key] = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+        return cls.windows[key]
+
+    @classmethod
+    def crop(cls, grid_hash, box, lats, lons, *fields):
+        """Return `lats`, `lons` and every array of `fields` cut down to the window of `box`, as views."""
+        rows, columns = cls.window(grid_hash, lats, lons, box)
+        return tuple(array[rows, columns] for array in (lats, lons) + fields)
+
+
+"""
+    Nearest grid cell lookup on curvilinear GRIB grids
+"""
+class GridTree:
+    directory = 'grids'
+    earth_radius = 6371.0  # km
+
+    # Grid hash -> KD-tree of the grid's cells as 3-D unit vectors
+    trees = {}
+
+    # (grid hash, locations, max distance) -> ((rows, columns), found)
+    cells = {}
+
+    @staticmethod
+    def unit_vectors(lats, lons):
+        lats = np.radians(np.asarray(lats, dtype=float))
+        lons = np.radians(np.asarray(lons, dtype=float))
+        return np.column_stack((np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)))
+
+    @classmethod
+    def tree(cls, grid_hash, lats, lons):
+        """
+        Return the KD-tree of the grid, built once per process from the grid's unit vectors. Unit vectors
+        keep distances exact across the whole grid, unlike raw degrees.
+        """
+        if grid_hash not in cls.trees:
+            cls.trees[grid_hash] = cKDTree(cls.unit_vectors(np.ravel(lats), np.ravel(lons)))
+        return cls.trees[grid_hash]
+
+    @classmethod
+    def nearest(cls, grid_hash, lats, lons, locations, max_distance=10.0):
+        """
+        Return ((rows, columns), found) for `locations`, a list of (lat, lon) pairs.
+
+        (rows, columns) index the grid cells nearest to the locations that have a cell within
+        `max_distance` km, `found` is the boolean mask of those locations. The result is saved in the
+        grid cache folder, so later runs with the same grid and locations never build the tree.
+        """
+        key = (grid_hash, tuple(locations), max_distance)
+        if key not in cls.cells:
+            cls.cells[key] = cls._load_cells(key, lats, lons)
+        return cls.cells[key]
+
+    @classmethod
+    def _load_cells(cls, key, lats, lons):
+        grid_hash, locations, max_distance = key
+        points = [[float(lat), float(lon)] for lat, lon in locations]
+        digest = hashlib.sha1(json.dumps([points, max_distance]).encode()).hexdigest()
+        path = os.path.join(Utils.get_cache_directory(cls.directory), '{}_{}_cells.npz'.format(grid_hash, digest))
+        try:
+            with np.load(path) as cached:
+                return (cached['rows'], cached['columns']), cached['found']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        points = cls.unit_vectors([lat for lat, lon in locations], [lon for lat, lon in locations])
+        # Chord length on the unit sphere of the largest distance allowed
+        chord = 2 * np.sin(max_distance / cls.earth_radius / 2)
+        distances, flat_indices = cls.tree(grid_hash, lats, lons).query(points, distance_upper_bound=chord)
+        found = np.isfinite(distances)
+        rows, columns = np.unravel_index(flat_indices[found], np.shape(lats))
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, rows=rows, columns=columns, found=found)
+        os.replace(temp_path, path)
+        return (rows, columns), found
+
+
+"""
+    Decode-once store of GRIB fields as memory mapped float32 arrays
+"""
+class FieldStore:
+    directory = 'fields'
+    manifest_name = 'manifest.json'
+
+    def __init__(self, index):
+        """
+        Open the store of the GRIB file behind `index`.
+
+        Fields live in a cache folder named after the GRIB file, with a manifest of each field's
+        variable, validDate and grid hash. The whole store is dropped when the GRIB file changes.
+        """
+        self.index = index
+        self.folder = os.path.join(Utils.get_cache_directory(self.directory), os.path.basename(index.path))
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        stat = os.stat(index.path)
+        self.source = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        manifest = self._read_manifest()
+        if manifest.get('source') != self.source:
+            for name in os.listdir(self.folder):
+                os.remove(os.path.join(self.folder, name))
+            self._write_manifest({'source': self.source, 'fields': {}})
+
+    def _manifest_path(self):
+        return os.path.join(self.folder, self.manifest_name)
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        temp_path = self._manifest_path() + '.{}.tmp'.format(os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self._manifest_path())
+
+    def values(self, entry, message=None):
+        """
+        Return the values of the message of index `entry` as a read-only float32 memory map, with
+        missing points set to NaN. The message is decoded and written only the first time, `message`
+        can be passed when the caller already holds it decoded.
+        """
+        path = os.path.join(self.folder, '{}.npy'.format(entry['number']))
+        if not os.path.exists(path):
+            if message is None:
+                message = self.index.read(entry)
+            values = np.ma.filled(np.ma.asarray(message.values, dtype=np.float32), np.nan)
+
+            temp_path = path + '.{}.tmp'.format(os.getpid())
+            with open(temp_path, 'wb') as f:
+                np.save(f, values)
+            os.replace(temp_path, path)
+
+            # Read the manifest again, parallel workers may have added other fields meanwhile
+            manifest = self._read_manifest()
+            manifest.setdefault('source', self.source)
+            manifest.setdefault('fields', {})[str(entry['number'])] = {
+                'file': os.path.basename(path),
+                'variable': entry['name'],
+                'validDate': entry['validDate'].isoformat(),
+                'grid': entry['grid'],
+                'shape': list(values.shape),
+            }
+            self._write_manifest(manifest)
+        return np.load(path, mmap_mode='r')
+
+    def sample(self, entry, locations):
+        """Return the value of `entry`'s field in the grid cell nearest to each (lat, lon) of `locations`, NaN off the grid."""
+        lats, lons = self.index.latlons(entry)
+        cells, found = GridTree.nearest(entry['grid'], lats, lons, locations)
+        values = np.full(len(locations), np.nan, dtype=np.float32)
+        values[found] = self.values(entry)[cells]
+        return values
+
+
+def group_by_valid_date(entries):
+    """Return the first index entry of every validDate in `entries`, in file order."""
+    seen = set()
+    first_entries = []
+    for entry in entries:
+        if entry['validDate'] not in seen:
+            seen.add(entry['validDate'])
+            first_entries.append(entry)
+    return first_entries
+
+
+"""
+    Typed table of the messages in a CPC outlook dataset
+"""
+class CPCMessage:
+    # Length of the outlook period in days for every CPC product
+    products = {5: '6-10day', 7: '8-14day', 14: '3-4week'}
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.kind = 'Temperatures' if entry['parameterName'] == 'Temperature' else 'Precipitations'
+        self.event = entry['event']
+        self.lower_limit = entry['lowerLimit']
+        self.upper_limit = entry['upperLimit']
+        self.validDate = entry['validDate']
+        self.product = self.product_for_period(entry['periodHours'])
+
+    @classmethod
+    def product_for_period(cls, period_hours):
+        days = period_hours / 24
+        if days in cls.products:
+            return cls.products[days]
+        elif 28 <= days <= 31:
+            return 'monthly'
+        elif 89 <= days <= 92:
+            return 'seasonal'
+        return None
+
+
+def classify_cpc(index, product=None):
+    """
+    Return a CPCMessage for every message of a CPC dataset in one pass over its index, optionally
+    limited to one `product` ('6-10day', '8-14day', '3-4week', 'monthly' or 'seasonal').
+    """
+    messages = [CPCMessage(entry) for entry in index.entries]
+    if product is not None:
+        messages = [message for message in messages if message.product == product]
+    return messages
@@ -177,6 +177,38 @@ class Utils:
             os.mkdir('output')
         os.chdir('output')
 
+    @staticmethod
+    def resolve_url(url):
+        # Send requests to a local replay server instead of the live sites when NICKELBLOCK_BASE_URL is set
+        import os
+        from urllib.parse import urlsplit, urlunsplit
+        base_url = os.environ.get('NICKELBLOCK_BASE_URL')
+        if not base_url:
+            return url
+        base = urlsplit(base_url)
+        parts = urlsplit(url)
+        # The original host leads the path, so the replay server can tell the sites apart
+        path = base.path.rstrip('/') + '/' + parts.netloc + parts.path
+        return urlunsplit((base.scheme, base.netloc, path, parts.query, parts.fragment))
+
+    @staticmethod
+    def resolve_access_url(access_url, catalog_url):
+        # siphon builds access URLs from the host of the catalog it read, which is the replay server's when
+        # NICKELBLOCK_BASE_URL is set. Put the catalog's original host back before resolving the URL.
+        from urllib.parse import urlsplit, urlunsplit
+        catalog = urlsplit(catalog_url)
+        parts = urlsplit(access_url)
+        return Utils.resolve_url(urlunsplit((catalog.scheme, catalog.netloc, parts.path, parts.query, parts.fragment)))
+
+    @staticmethod
+    def get_cache_directory(name):
+        # Caches live next to the output folder and are shared by every generator
+        import os
+        directory = os.path.join('..', 'cache', name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return directory
+
     @staticmethod
     def get_logo():
         import cv2
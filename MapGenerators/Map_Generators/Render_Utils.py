@@ -0,0 +1,83 @@
+import cartopy.crs as ccrs
+import matplotlib.pyplot as plt
+from matplotlib.offsetbox import AnchoredText
+
+import Geometry_Utils as geometry_utils
+
+
+"""
+    Figure of one map type reused for every frame of a run
+"""
+class FrameRenderer:
+    def __init__(self, map_, data_model, logo, logo_position, layer_set, figsize=(15, 9)):
+        """
+        Build the parts of the figure that do not change between frames: the axes set to the map's
+        extent, the basemap of `layer_set`, the copyright and data model boxes and the logo at
+        `logo_position` pixels.
+        """
+        self.map_ = map_
+        self.fig = plt.figure(figsize=figsize)
+        self.ax = self.fig.add_subplot(1, 1, 1, projection=ccrs.Mercator())
+        self.ax.set_extent(map_.NorthSouthEastWest[::-1], crs=ccrs.Geodetic())
+
+        # States, counties, land and ocean come from the pre-rendered basemap of this map type
+        geometry_utils.Basemap.add_to(self.ax, map_, layer_set)
+
+        # Company copyright on the bottom right corner
+        self.ax.add_artist(AnchoredText('© NickelBlock Forecasting', loc=4, prop={'size': 9}, frameon=True))
+
+        # Data model on the bottom left corner
+        self.ax.add_artist(AnchoredText(data_model, loc=3, prop={'size': 9}, frameon=True))
+
+        # Add logo
+        self.fig.figimage(logo, *logo_position, zorder=1)
+
+        # Artists of the current frame, removed once the frame is saved
+        self.frame_artists = []
+        self.colorbar = None
+        # Axes the colorbar is drawn in, laid out on the first frame and kept for the others
+        self.colorbar_axes = None
+
+    def contourf(self, *args, **kwargs):
+        contour_set = self.ax.contourf(*args, **kwargs)
+        self.frame_artists.append(contour_set)
+        return contour_set
+
+    def text(self, *args, **kwargs):
+        text = self.ax.text(*args, **kwargs)
+        self.frame_artists.append(text)
+        return text
+
+    def plot(self, *args, **kwargs):
+        lines = self.ax.plot(*args, **kwargs)
+        self.frame_artists.extend(lines)
+        return lines
+
+    def set_colorbar(self, mappable, ticks=None, **kwargs):
+        """
+        Draw the colorbar of `mappable`. The axes of the colorbar are laid out on the first frame with `kwargs`,
+        later frames clear those axes and draw a new colorbar in them, so the boundaries, ticks and labels
+        always come from the current frame while the layout of the figure stays put.
+        """
+        if self.colorbar_axes is None:
+            self.colorbar = self.fig.colorbar(mappable, ax=self.ax, ticks=ticks, **kwargs)
+            self.colorbar_axes = self.colorbar.ax
+        else:
+            self.colorbar_axes.clear()
+            self.colorbar = self.fig.colorbar(mappable, cax=self.colorbar_axes, ticks=ticks, **kwargs)
+        return self.colorbar
+
+    def save(self, file_name):
+        """Save the current frame and clear its artists, leaving the static figure for the next frame."""
+        self.fig.savefig(file_name)
+        for artist in self.frame_artists:
+            if hasattr(artist, 'remove'):
+                artist.remove()
+            else:
+                # ContourSets are not artists before matplotlib 3.8, their collections are
+                for collection in artist.collections:
+                    collection.remove()
+        self.frame_artists = []
+
+    def close(self):
+        plt.close(self.fig)
@@ -1,18 +1,29 @@
-import urllib.error
-import urllib.request
+import os
+import sys
 
 import scrapy
 
+# The download engine lives with the map generators, three folders up from the spiders
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+import Map_Utils as map_utils
+import Download_Utils as download_utils
+Utils = map_utils.Utils()
+
 
 class SPC_CPC_dataset_downloader(scrapy.Spider):
     name = "SPC_CPC_dataset_downloader"
 
+    # SPC and CPC files are fetched side by side without blocking the reactor
+    downloader = download_utils.AsyncDownloader(per_host_limit=2)
+
     def start_requests(self):
         start_urls = [
             'https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/SPC/CONUS/latest.html',  # SPC
             'https://tds.scigw.unidata.ucar.edu/thredds/catalog/grib/NCEP/NDFD/CPC/CONUS/latest.html',  # CPC
         ]
 
+        start_urls = [Utils.resolve_url(url) for url in start_urls]
+
         yield scrapy.Request(start_urls[0], callback=self.parse, meta={'start_url': start_urls[0]})
         yield scrapy.Request(start_urls[1], callback=self.parse, meta={'start_url': start_urls[1]})
 
@@ -23,8 +34,8 @@ class SPC_CPC_dataset_downloader(scrapy.Spider):
 
         yield scrapy.Request(url, callback=self.download_data)
 
-    def download_data(self, response):
-        base_url = 'https://tds.scigw.unidata.ucar.edu'
+    async def download_data(self, response):
+        base_url = Utils.resolve_url('https://tds.scigw.unidata.ucar.edu')
         dl_links = response.css('html body ol li a::attr(href)').getall()
         for link in dl_links:
             if 'fileServer' in link:
@@ -35,6 +46,6 @@ class SPC_CPC_dataset_downloader(scrapy.Spider):
             dataset_type = 'CPC_data'
 
         try:
-            urllib.request.urlretrieve(download_link, '../../../output/{}.grb2'.format(dataset_type))
-        except urllib.error.URLError:
+            await self.downloader.sync_file(download_link, '../../../output/{}.grb2'.format(dataset_type))
+        except download_utils.AsyncDownloader.retry_exceptions:
             print('Dataset download link not found.')
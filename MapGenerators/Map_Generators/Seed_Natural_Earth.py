@@ -0,0 +1,11 @@
+import Geometry_Utils as geometry_utils
+
+
+def main():
+    # Fill the local Natural Earth store so the generators and blank maps can draw offline
+    for path in geometry_utils.FeatureStore.seed():
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+"""
+    Local stand-in for THREDDS and the NWS sites used by the map generators and scrapers.
+
+    Point the code at it with the NICKELBLOCK_BASE_URL environment variable, e.g.
+    NICKELBLOCK_BASE_URL=http://localhost:8000. Utils.resolve_url puts the original host first in the
+    path (http://localhost:8000/thredds.ucar.edu/thredds/...), and responses are served from recorded
+    fixtures matched on that host, the path and the query. Query parameters in `--ignore-params` (the
+    request times by default) are left out of the match so recordings keep working on later days.
+"""
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+INDEX_FILE = 'index.json'
+
+
+class FixtureStore:
+    def __init__(self, directory, ignore_params):
+        self.directory = directory
+        self.ignore_params = set(ignore_params)
+        self.lock = threading.Lock()
+        try:
+            with open(os.path.join(directory, INDEX_FILE)) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def key(self, path):
+        # Match on the host and path plus every query parameter that is not ignored, in a stable order
+        host, path = split_host(path)
+        parts = urlsplit(path)
+        params = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                        if k not in self.ignore_params)
+        return host + parts.path + ('?' + urlencode(params) if params else '')
+
+    def get(self, path):
+        """Return (entry, body) of the fixture recorded for `path` or None."""
+        entry = self.index.get(self.key(path))
+        if entry is None:
+            return None
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            return entry, f.read()
+
+    def record(self, path, status, content_type, body):
+        key = self.key(path)
+        file_name = hashlib.sha1(key.encode()).hexdigest() + '.bin'
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, file_name), 'wb') as f:
+                f.write(body)
+            self.index[key] = {
+                'file': file_name,
+                'status': status,
+                'content_type': content_type,
+                'etag': '"{}"'.format(hashlib.sha1(body).hexdigest()),
+                'last_modified': formatdate(usegmt=True),
+            }
+            with open(os.path.join(self.directory, INDEX_FILE), 'w') as f:
+                json.dump(self.index, f, indent=2, sort_keys=True)
+        return self.index[key]
+
+
+def split_host(path):
+    """Split a request path of the form /<host>/<path> into the original host and its own path."""
+    host, _, path = path.lstrip('/').partition('/')
+    return host, '/' + path
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    # Set by main() before the server starts
+    store = None
+    record = False
+    upstream_scheme = 'https'
+    upstream_timeout = 60.0
+    latency = 0.0
+    bandwidth = None
+    chunk_size = 64 * 1024
+
+    def do_GET(self):
+        found = self.store.get(self.path)
+        if found is None and self.record:
+            try:
+                found = self.record_from_upstream()
+            except UpstreamError as e:
+                self.send_error(502, str(e))
+                return
+        if found is None:
+            self.send_error(404, 'No fixture recorded for {}'.format(self.store.key(self.path)))
+            return
+        entry, body = found
+
+        # Simulated round trip time
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.not_modified(entry):
+            self.send_response(304)
+            self.send_validators(entry)
+            self.end_headers()
+            return
+
+        status, body, content_range = self.apply_range(entry, body)
+        self.send_response(status)
+        self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.send_validators(entry)
+        self.end_headers()
+        self.write_throttled(body)
+
+    def do_HEAD(self):
+        found = self.store.get(self.path)
+        if found is None:
+            self.send_error(404)
+            return
+        entry, body = found
+        self.send_response(entry['status'])
+        self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Content-Length', str(len(body)))
+        self.send_validators(entry)
+        self.end_headers()
+
+    def send_validators(self, entry):
+        self.send_header('ETag', entry['etag'])
+        self.send_header('Last-Modified', entry['last_modified'])
+
+    def not_modified(self, entry):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match == entry['etag']
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                return parsedate_to_datetime(entry['last_modified']) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def apply_range(self, entry, body):
+        """Return (status, body, Content-Range) honouring a single `bytes=N-[M]` Range header."""
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if not range_header or not range_header.startswith('bytes=') or entry['status'] != 200:
+            return entry['status'], body, None
+        if if_range is not None and if_range not in (entry['etag'], entry['last_modified']):
+            return 200, body, None
+
+        start, _, end = range_header[len('bytes='):].partition('-')
+        start = int(start or 0)
+        end = int(end) if end else len(body) - 1
+        if start >= len(body):
+            return 416, b'', 'bytes */{}'.format(len(body))
+        return 206, body[start:end + 1], 'bytes {}-{}/{}'.format(start, min(end, len(body) - 1), len(body))
+
+    def write_throttled(self, body):
+        # Without a bandwidth limit the whole body goes out at once
+        if not self.bandwidth:
+            self.wfile.write(body)
+            return
+        for offset in range(0, len(body), self.chunk_size):
+            chunk = body[offset:offset + self.chunk_size]
+            time.sleep(len(chunk) / self.bandwidth)
+            self.wfile.write(chunk)
+
+    def record_from_upstream(self):
+        """Fetch the request from its original host and store it as a fixture, None when the host has no such page."""
+        host, path = split_host(self.path)
+        url = '{}://{}{}'.format(self.upstream_scheme, host, path)
+        try:
+            with urllib.request.urlopen(url, timeout=self.upstream_timeout) as response:
+                body = response.read()
+                content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise UpstreamError('{} answered {}'.format(url, e.code))
+        except OSError as e:
+            # Timeouts land here as well
+            raise UpstreamError('{} failed: {}'.format(url, e))
+        entry = self.store.record(self.path, 200, content_type, body)
+        return entry, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded THREDDS/NWS responses locally.')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on.')
+    parser.add_argument('-d', '--fixtures', default=FIXTURES_DIRECTORY, help='Folder holding the fixtures.')
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='Seconds added before every response.')
+    parser.add_argument('-b', '--bandwidth', type=float, default=None,
+                        help='Response bandwidth limit in kilobytes per second.')
+    parser.add_argument('-r', '--record', action='store_true',
+                        help='Record missing fixtures from the original hosts.')
+    parser.add_argument('--upstream-scheme', choices=['https', 'http'], default='https',
+                        help='Scheme used to reach the original hosts when recording.')
+    parser.add_argument('--upstream-timeout', type=float, default=60.0,
+                        help='Seconds to wait on an original host when recording.')
+    parser.add_argument('--ignore-params', nargs='*', default=['time', 'time_start', 'time_end'],
+                        help='Query parameters left out when matching requests to fixtures.')
+    args = parser.parse_args()
+
+    ReplayHandler.store = FixtureStore(args.fixtures, args.ignore_params)
+    ReplayHandler.record = args.record
+    ReplayHandler.upstream_scheme = args.upstream_scheme
+    ReplayHandler.upstream_timeout = args.upstream_timeout
+    ReplayHandler.latency = args.latency
+    ReplayHandler.bandwidth = args.bandwidth * 1024 if args.bandwidth else None
+
+    server = ThreadingHTTPServer(('localhost', args.port), ReplayHandler)
+    print('Replaying {} fixtures on http://localhost:{}'.format(len(ReplayHandler.store.index), args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from replay_server import FixtureStore, ReplayHandler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MapGenerators', 'Map_Generators'))
+import Download_Utils as download_utils
+
+FIXTURE_PATH = '/example.com/data/file.grib2'
+BODY = bytes(range(256)) * 1024
+
+
+class RecordingHandler(ReplayHandler):
+    # Headers of every GET, and the number of bytes after which the next response is cut off
+    seen = None
+    interrupt_after = None
+
+    def do_GET(self):
+        self.seen.append(dict(self.headers))
+        super().do_GET()
+
+    def write_throttled(self, body):
+        if self.interrupt_after is None:
+            super().write_throttled(body)
+            return
+        # Only the first response is cut off, the connection closes with the body incomplete
+        self.wfile.write(body[:self.interrupt_after])
+        type(self).interrupt_after = None
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    store = FixtureStore(str(tmp_path / 'fixtures'), [])
+    store.record(FIXTURE_PATH, 200, 'application/octet-stream', BODY)
+    handler = type('Handler', (RecordingHandler,), {'store': store, 'seen': []})
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, 'http://127.0.0.1:{}{}'.format(httpd.server_address[1], FIXTURE_PATH)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def downloader():
+    downloader = download_utils.AsyncDownloader(timeout=10, retries=0, backoff=0, chunk_size=1024)
+    # Talk to the local server directly, whatever proxy the environment sets
+    downloader.session.trust_env = False
+    return downloader
+
+
+def test_interrupted_download_resumes_with_range(server, downloader, tmp_path):
+    handler, url = server
+    path = str(tmp_path / 'file.grib2')
+    handler.interrupt_after = len(BODY) // 2
+
+    with pytest.raises(downloader.retry_exceptions):
+        downloader._download(url, path)
+    # Only the part file exists until the transfer completes
+    assert not os.path.exists(path)
+    part_size = os.path.getsize(path + '.part')
+    assert 0 < part_size < len(BODY)
+
+    downloader._download(url, path)
+    etag = handler.store.get(FIXTURE_PATH)[0]['etag']
+    assert handler.seen[-1]['Range'] == 'bytes={}-'.format(part_size)
+    assert handler.seen[-1]['If-Range'] == etag
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(path + '.part')
+    assert not os.path.exists(path + '.part.validator')
+
+
+def test_changed_file_is_downloaded_again(server, downloader, tmp_path):
+    handler, url = server
+    path = str(tmp_path / 'file.grib2')
+    with open(path + '.part', 'wb') as f:
+        f.write(b'stale')
+    with open(path + '.part.validator', 'w') as f:
+        f.write('"an older version"')
+
+    downloader._download(url, path)
+    # The If-Range validator does not match, so the server sends the whole file
+    assert 'Range' in handler.seen[-1]
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_unsatisfiable_range_starts_over(server, downloader, tmp_path):
+    handler, url = server
+    path = str(tmp_path / 'file.grib2')
+    etag = handler.store.get(FIXTURE_PATH)[0]['etag']
+    with open(path + '.part', 'wb') as f:
+        f.write(BODY + b'trailing bytes')
+    with open(path + '.part.validator', 'w') as f:
+        f.write(etag)
+
+    downloader._download(url, path)
+    assert handler.seen[0]['Range'] == 'bytes={}-'.format(len(BODY) + len(b'trailing bytes'))
+    assert 'Range' not in handler.seen[1]
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(path + '.part')
+
+
+def test_unchanged_file_is_not_downloaded_again(server, downloader, tmp_path):
+    handler, url = server
+    path = str(tmp_path / 'file.grib2')
+
+    assert asyncio.run(downloader.sync_file(url, path))
+    modified = os.path.getmtime(path)
+
+    assert not asyncio.run(downloader.sync_file(url, path))
+    assert handler.seen[-1]['If-None-Match'] == handler.store.get(FIXTURE_PATH)[0]['etag']
+    assert os.path.getmtime(path) == modified
+
+
+def test_not_modified_leaves_the_file_alone(server, downloader, tmp_path):
+    handler, url = server
+    path = str(tmp_path / 'file.grib2')
+    etag = handler.store.get(FIXTURE_PATH)[0]['etag']
+
+    assert downloader._download(url, path, {'If-None-Match': etag}) is None
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.part')
@@ -7,6 +7,14 @@ import re
 import glob
 import xml.etree.ElementTree as ET
 import os
+import sys
+
+# Send requests to a local replay server instead of the live sites when NICKELBLOCK_BASE_URL is set,
+# with the same helper as the map generators
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'MapGenerators', 'Map_Generators'))
+import Map_Utils as map_utils
+Utils = map_utils.Utils()
+
 
 # Zone IDs
 Z0 = "MSZ075"
@@ -31,7 +39,7 @@ urls = [
 # Loop through each URL
 for i, url in enumerate(urls):
     # Send a GET request to the URL
-    page = requests.get(url)
+    page = requests.get(Utils.resolve_url(url))
 
     # Parse the HTML content using Beautiful Soup
     soup = BeautifulSoup(page.content, "html.parser")
@@ -89,7 +97,7 @@ for i, url in enumerate(urls):
 
 url = 'https://forecast.weather.gov/product.php?site=NWS&issuedby=JAN&product=AFD&format=CI&version=1&glossary=0'
 
-response = requests.get(url)
+response = requests.get(Utils.resolve_url(url))
 soup = BeautifulSoup(response.content, 'html.parser')
 
 pre_tag = soup.find('pre', class_='glossaryProduct')
@@ -117,7 +125,7 @@ else:
 
 # Get the content of the RSS feed
 url = 'https://www.spc.noaa.gov/products/spcmdrss.xml'
-response = requests.get(url)
+response = requests.get(Utils.resolve_url(url))
 xml_content = response.content
 
 # Parse the XML content
@@ -143,7 +151,7 @@ with open('/Users/nicke/Documents/SPCoutput.html', 'w') as f:
 url = 'https://www.spc.noaa.gov/products/md/'
 
 # Send a GET request to the URL
-response = requests.get(url)
+response = requests.get(Utils.resolve_url(url))
 
 # Check if the request was successful
 if response.status_code == 200:
@@ -161,7 +169,7 @@ if response.status_code == 200:
 
         # Download the HTML file
         file_name = os.path.basename(latest_md_url)
-        response = requests.get(latest_md_url)
+        response = requests.get(Utils.resolve_url(latest_md_url))
         if response.status_code == 200:
             with open(file_name, 'wb') as f:
                 f.write(response.content)
@@ -1,11 +1,24 @@
 import os
 import re
+import sys
+from urllib.parse import urlsplit
+
 import scrapy
 
+# Requests go through the map generators' resolve_url, four folders up from the spiders
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..',
+                             'MapGenerators', 'Map_Generators'))
+import Map_Utils as map_utils
+Utils = map_utils.Utils()
+
+# Send requests to a local replay server instead of the live sites when NICKELBLOCK_BASE_URL is set
+BASE_URL = os.environ.get('NICKELBLOCK_BASE_URL')
+
+
 class TropicalWeatherOutlook(scrapy.Spider):
 
     name = "tropical_weather_outlook"
-    allowed_domains = ['www.nhc.noaa.gov']
+    allowed_domains = ['www.nhc.noaa.gov'] + ([urlsplit(BASE_URL).hostname] if BASE_URL else [])
 
     def start_requests(self):
 
@@ -21,7 +34,7 @@ class TropicalWeatherOutlook(scrapy.Spider):
         ]
 
         for url in start_urls:
-            yield scrapy.Request(url=url, callback=self.parse)
+            yield scrapy.Request(url=Utils.resolve_url(url), callback=self.parse)
 
     def parse(self, response):
         '''